@@ -12,42 +12,109 @@
 - 高ストレス状態の簡易判定
 """
 
+from operator import itemgetter
+
 import streamlit as st
-import pandas as pd
-import altair as alt
-from data import questions_data, scales
+import numpy as np
+from data import questions_data, scales, QUESTION_IDS, REVERSE_SET, ID_TO_SCALE
 
 # --- 定数定義 ---
 
-# 回答の選択肢とスコア
+# 回答の選択肢とスコア。回答はOPTIONSのインデックス（0〜3）で保持し、
+# SCORE_VALUES[コード]で素点に変換する（逆転項目は 5 - 素点）
 OPTIONS = ["そうだ", "まあそうだ", "ややちがう", "ちがう"]
-SCORE_MAP = {"そうだ": 4, "まあそうだ": 3, "ややちがう": 2, "ちがう": 1}
-SCORE_MAP_REVERSE = {"そうだ": 1, "まあそうだ": 2, "ややちがう": 3, "ちがう": 4}
+SCORE_VALUES = (4, 3, 2, 1)
+
+# 尺度×質問の接続行列。素点ベクトルとの積で全尺度の合計点が一度に求まる
+SCALE_NAMES = list(scales)
+_SCALE_INDEX = {name: i for i, name in enumerate(SCALE_NAMES)}
+SCALE_MATRIX = np.zeros((len(SCALE_NAMES), len(QUESTION_IDS)), dtype=np.int8)
+for _col, _qid in enumerate(QUESTION_IDS):
+    SCALE_MATRIX[_SCALE_INDEX[ID_TO_SCALE[_qid]], _col] = 1
+
+# 各尺度の満点（設問数 × 最大スコア4）
+MAX_SCORES = {name: len(ids) * 4 for name, ids in scales.items()}
+
+def _tile_style(score, max_score):
+    """ヒートマップタイルの(色相, 文字色)を計算します。"""
+    normalized_val = score / max_score if max_score > 0 else 0
+    hue = 120 * (1 - normalized_val)
+    return hue, 'black' if 50 < hue < 130 else 'white'
+
+# 点数は 0〜満点 の整数しか取らないので、尺度ごとに全点数分のスタイルを事前計算
+HUE_LUT = {name: [_tile_style(score, max_score) for score in range(max_score + 1)]
+           for name, max_score in MAX_SCORES.items()}
+
+# ページネーション。質問データは固定なのでページ分割も起動時に1回だけ行う
+QUESTIONS_PER_PAGE = 10
+PAGES = [questions_data[i:i + QUESTIONS_PER_PAGE]
+         for i in range(0, len(questions_data), QUESTIONS_PER_PAGE)] or [[]]
+NUM_PAGES = len(PAGES)
 
 # 高ストレス判定のカテゴリ
-STRESSOR_SCALES = ["量的負担", "質的負担", "裁量権", "仕事の適性", "職場人間関係", "職場環境"]
-REACTION_SCALES = ["活気", "イライラ感", "疲労感", "不安感", "抑うつ感", "身体愁訴"]
-SUPPORT_SCALES = ["上司のサポート", "同僚のサポート", "家族・友人のサポート"]
+STRESSOR_SCALES = ("量的負担", "質的負担", "裁量権", "仕事の適性", "職場人間関係", "職場環境")
+REACTION_SCALES = ("活気", "イライラ感", "疲労感", "不安感", "抑うつ感", "身体愁訴")
+SUPPORT_SCALES = ("上司のサポート", "同僚のサポート", "家族・友人のサポート")
+
+# itemgetterは1回のC呼び出しでカテゴリ内全尺度の点数タプルを返す
+# （尺度が欠けていればKeyErrorになり、データ不整合に早く気づける）
+_get_stressor_scores = itemgetter(*STRESSOR_SCALES)
+_get_reaction_scores = itemgetter(*REACTION_SCALES)
+_get_support_scores = itemgetter(*SUPPORT_SCALES)
+
+# 高ストレス判定の根拠メッセージ（bit0: ストレス反応、bit1: 要因＋サポート）
+_REASON_REACTION = "心身のストレス反応の合計点数が高いレベルにあります。"
+_REASON_STRESSOR = "仕事のストレス要因と、周囲のサポートの状況から、高いストレス状態にある可能性が考えられます。"
+HIGH_STRESS_REASONS = {
+    0b01: (_REASON_REACTION,),
+    0b10: (_REASON_STRESSOR,),
+    0b11: (_REASON_REACTION, _REASON_STRESSOR),
+}
 
 # グラフのカテゴリと色
 CHART_DEFINITIONS = {
     "ストレス要因のバランス": {
-        "scales": ["量的負担", "質的負担", "裁量権", "仕事の適性", "職場人間関係", "職場環境", "働きがい"],
-        "colors": ["#1f77b4", "#3a8ac1", "#559dce", "#70b0db", "#8bc3e8", "#a6d6f5", "#c1e9ff"],
+        "scales": ("量的負担", "質的負担", "裁量権", "仕事の適性", "職場人間関係", "職場環境", "働きがい"),
+        "colors": ("#1f77b4", "#3a8ac1", "#559dce", "#70b0db", "#8bc3e8", "#a6d6f5", "#c1e9ff"),
         "height": 300
     },
     "心身のストレス反応": {
-        "scales": ["活気", "イライラ感", "疲労感", "不安感", "抑うつ感", "身体愁訴"],
-        "colors": ["#d62728", "#e05757", "#ea7a7a", "#f49d9d", "#ffc0c0", "#ffe3e3"],
+        "scales": ("活気", "イライラ感", "疲労感", "不安感", "抑うつ感", "身体愁訴"),
+        "colors": ("#d62728", "#e05757", "#ea7a7a", "#f49d9d", "#ffc0c0", "#ffe3e3"),
         "height": 250
     },
     "周囲からのサポート": {
-        "scales": ["上司のサポート", "同僚のサポート", "家族・友人のサポート"],
-        "colors": ["#2ca02c", "#55b355", "#7fca7f"],
+        "scales": ("上司のサポート", "同僚のサポート", "家族・友人のサポート"),
+        "colors": ("#2ca02c", "#55b355", "#7fca7f"),
         "height": 150
     }
 }
 
+# グラフごとの行キーと、scale_scoresから点数タプルを一括取得するitemgetter
+CHART_ROW_KEYS = {title: definition["scales"]
+                  for title, definition in CHART_DEFINITIONS.items()}
+CHART_GETTERS = {title: itemgetter(*keys) for title, keys in CHART_ROW_KEYS.items()}
+
+@st.cache_resource
+def get_chart_specs():
+    """CHART_DEFINITIONSから静的なVega-Lite仕様を構築して返します。
+
+    仕様はデータ以外固定なので、プロセス内で一度だけ組み立てる。
+    """
+    return {
+        title: {
+            "mark": "bar",
+            "height": definition["height"],
+            "encoding": {
+                "x": {"field": "点数", "type": "quantitative", "title": "合計点"},
+                "y": {"field": "尺度", "type": "nominal", "sort": None, "title": ""},
+                "color": {"field": "尺度", "type": "nominal", "legend": None,
+                          "scale": {"range": definition["colors"]}},
+            },
+        }
+        for title, definition in CHART_DEFINITIONS.items()
+    }
+
 # --- UI関連の関数 ---
 
 def render_header():
@@ -56,88 +123,120 @@ def render_header():
     st.write("ご自身のストレス状態をチェックしてみましょう。各質問について、最も当てはまるものを1つ選んでください。")
     st.info("注意：このツールはあくまでプロトタイプであり、医学的診断に代わるものではありません。")
 
+@st.fragment
+def render_sidebar_progress():
+    """回答の進捗表示のみを再実行するフラグメント。"""
+    st.markdown("---")
+    st.subheader("進捗")
+    total_questions = len(questions_data)
+    answered_count = len(st.session_state.answers)
+    progress = answered_count / total_questions if total_questions > 0 else 0
+
+    st.progress(progress)
+    st.write(f"進捗: {answered_count} / {total_questions} 問")
+
+@st.fragment
+def questionnaire_section():
+    """質問票と操作ボタンのブロックのみを再実行するフラグメント。
+
+    ラジオボタンのクリックではこのブロックだけが再実行され、
+    ページ遷移や結果表示への切り替え時はst.rerun()で全体を再実行する。
+    """
+    render_questionnaire()
+    handle_navigation()
+
+def _record_answer(qid):
+    """ラジオボタン変更時にのみ回答を保存するコールバック。
+
+    ウィジェットのキーはページ切り替えで破棄されるため、回答は
+    answersディクショナリに保持するが、書き込みは変更時の1回だけに抑える。
+    回答文字列そのものではなくOPTIONSのインデックスを保存する。
+    """
+    st.session_state.answers[qid] = OPTIONS.index(st.session_state[qid])
+
 def render_questionnaire():
     """質問票をページネーションで表示し、ユーザーの回答を収集します。"""
-    QUESTIONS_PER_PAGE = 10
-    
     # 現在のページに対応する質問を取得
-    start_index = st.session_state.current_page * QUESTIONS_PER_PAGE
-    end_index = start_index + QUESTIONS_PER_PAGE
-    current_questions = questions_data[start_index:end_index]
+    current_questions = PAGES[st.session_state.current_page]
 
     # 質問の表示と回答の収集
-    for q in current_questions:
-        st.markdown(f'<p class="question-text">{q["text"]}</p>', unsafe_allow_html=True)
-        
-        current_answer = st.session_state.answers.get(q["id"])
-        try:
-            default_index = OPTIONS.index(current_answer) if current_answer in OPTIONS else 0
-        except ValueError:
-            default_index = 0
-        
-        answer = st.radio(
+    # 区切り線は次の質問文と同じmarkdown呼び出しにまとめ、1質問あたりの
+    # 要素数（＝フロントエンドへの差分メッセージ数）を減らす
+    for i, q in enumerate(current_questions):
+        separator = '<hr>' if i > 0 else ''
+        st.markdown(f'{separator}<p class="question-text">{q["text"]}</p>', unsafe_allow_html=True)
+
+        # 回答コードはOPTIONSのインデックスそのものなので、そのまま初期値に使える
+        # （未回答の質問は選択なしで表示する）
+        default_index = st.session_state.answers.get(q["id"])
+
+        st.radio(
             label="",
             options=OPTIONS,
             key=q["id"],
             horizontal=True,
-            index=default_index
+            index=default_index,
+            on_change=_record_answer,
+            args=(q["id"],)
         )
-        st.session_state.answers[q["id"]] = answer
+
+    if current_questions:
         st.markdown("---")
 
+def _go_to_page(page):
+    """ページ番号をセッション状態とURLクエリの両方に反映するコールバック。
+
+    ボタンのon_clickで呼ばれるため、明示的なst.rerun()なしで
+    フラグメントの再実行だけでページが切り替わる。URLを共有・リロード
+    しても同じページが開く。
+    """
+    st.session_state.current_page = page
+    st.query_params["page"] = str(page)
+
 def handle_navigation():
     """ページネーションのナビゲーションボタンを処理します。"""
-    QUESTIONS_PER_PAGE = 10
-    total_questions = len(questions_data)
-    num_pages = (total_questions + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE if total_questions > 0 else 1
-    
     col1, col2, col3 = st.columns([1, 2, 1])
 
     with col1:
         if st.session_state.current_page > 0:
-            if st.button("⬅️ 前へ"):
-                st.session_state.current_page -= 1
-                st.rerun()
+            st.button("⬅️ 前へ", on_click=_go_to_page,
+                      args=(st.session_state.current_page - 1,))
 
     with col3:
-        if st.session_state.current_page < num_pages - 1:
-            if st.button("次へ ➡️"):
-                st.session_state.current_page += 1
-                st.rerun()
+        if st.session_state.current_page < NUM_PAGES - 1:
+            st.button("次へ ➡️", on_click=_go_to_page,
+                      args=(st.session_state.current_page + 1,))
 
     # 最後のページに「診断結果を見る」ボタンを表示
-    if st.session_state.current_page == num_pages - 1:
+    if st.session_state.current_page == NUM_PAGES - 1:
         with col2:
             if st.button("診断結果を見る", type="primary"):
-                if len(st.session_state.answers) != total_questions:
-                    st.error("すべての質問に回答してください。")
+                # 件数比較ではなく質問ID基準で確認し、最初の未回答で打ち切る
+                # （answersに古いキーが残っていても誤判定しない）
+                answers = st.session_state.answers
+                first_missing = next((qid for qid in QUESTION_IDS if qid not in answers), None)
+                if first_missing is not None:
+                    st.error(f"すべての質問に回答してください。（質問 {first_missing} が未回答です）")
                 else:
-                    scores = calculate_scores(st.session_state.answers)
-                    scale_scores = calculate_scale_scores(scores)
+                    scale_scores = calculate_scale_scores(st.session_state.answers)
                     st.session_state.results = {"scale_scores": scale_scores}
                     st.session_state.show_results = True
                     st.rerun()
 
 # --- 計算関連の関数 ---
 
-def calculate_scores(answers):
-    """ユーザーの回答から各質問の素点を計算します。"""
-    scores = {}
-    for q in questions_data:
-        answer = answers.get(q["id"])
-        if answer:
-            if q.get("reverse", False):
-                scores[q["id"]] = SCORE_MAP_REVERSE[answer]
-            else:
-                scores[q["id"]] = SCORE_MAP[answer]
-    return scores
-
-def calculate_scale_scores(scores):
-    """素点から各評価尺度の合計点を計算します。"""
-    scale_scores = {}
-    for scale_name, question_ids in scales.items():
-        scale_scores[scale_name] = sum(scores.get(qid, 0) for qid in question_ids)
-    return scale_scores
+def _score(qid, code):
+    """1つの回答コード（OPTIONSのインデックス）の素点を返します。未回答は0。"""
+    if code is None:
+        return 0
+    base = SCORE_VALUES[code]
+    return 5 - base if qid in REVERSE_SET else base
+
+def calculate_scale_scores(answers):
+    """ユーザーの回答から各評価尺度の合計点を行列積で一括計算します。"""
+    scores_vec = np.fromiter((_score(qid, answers.get(qid)) for qid in QUESTION_IDS),
+                             dtype=np.int8, count=len(QUESTION_IDS))
+    return dict(zip(SCALE_NAMES, (SCALE_MATRIX @ scores_vec).tolist()))
 
 # --- 結果表示関連の関数 ---
 
@@ -153,6 +252,7 @@ def display_results():
     if st.button("最初からやり直す"):
         for key in list(st.session_state.keys()):
             del st.session_state[key]
+        st.query_params.clear()
         st.rerun()
 
 def display_heatmap(scale_scores):
@@ -160,62 +260,47 @@ def display_heatmap(scale_scores):
     st.header("診断結果ヒートマップ")
     st.write("各尺度のストレスレベルを色で示しています。赤に近いほどストレスが高い状態です。")
     
-    max_scores = {name: len(ids) * 4 for name, ids in scales.items()}
-    
-    html_string = '<div class="heatmap-container">'
+    tiles = []
     for scale_name, score in scale_scores.items():
-        max_score = max_scores.get(scale_name, score) 
-        normalized_val = score / max_score if max_score > 0 else 0
-        hue = 120 * (1 - normalized_val)
-        font_color = 'black' if 50 < hue < 130 else 'white'
-        html_string += (f'<div class="heatmap-tile" style="background-color: hsl({hue}, 85%, 55%); color: {font_color};">'
-                        f'<div class="tile-scale-name">{scale_name}</div>'
-                        f'<div class="tile-score">{score}</div>'
-                        f'</div>')
-    html_string += '</div>'
+        hue, font_color = HUE_LUT[scale_name][score]
+        tiles.append(f'<div class="heatmap-tile" style="background-color: hsl({hue}, 85%, 55%); color: {font_color};">'
+                     f'<div class="tile-scale-name">{scale_name}</div>'
+                     f'<div class="tile-score">{score}</div>'
+                     f'</div>')
+    html_string = f'<div class="heatmap-container">{"".join(tiles)}</div>'
     st.markdown(html_string, unsafe_allow_html=True)
 
 def display_high_stress_warning(scale_scores):
     """高ストレス状態の判定と警告を表示します。"""
     st.subheader("総合的なストレスレベルの評価")
-    total_stressor = sum(scale_scores.get(s, 0) for s in STRESSOR_SCALES)
-    total_reaction = sum(scale_scores.get(s, 0) for s in REACTION_SCALES)
-    total_support = sum(scale_scores.get(s, 0) for s in SUPPORT_SCALES)
+    total_stressor = sum(_get_stressor_scores(scale_scores))
+    total_reaction = sum(_get_reaction_scores(scale_scores))
+    total_support = sum(_get_support_scores(scale_scores))
 
-    is_high_stress = False
-    if total_reaction >= 77:
-        is_high_stress = True
+    # 判定条件をビットマスクにまとめ、表示は1経路に集約する
+    reasons_mask = (total_reaction >= 77) | ((total_stressor >= 76 and total_support >= 36) << 1)
+    if reasons_mask:
         st.warning("高ストレス状態にある可能性が高いです。")
-        st.write("心身のストレス反応の合計点数が高いレベルにあります。")
-
-    if total_stressor >= 76 and total_support >= 36:
-        if not is_high_stress:
-            st.warning("高ストレス状態にある可能性が高いです。")
-        is_high_stress = True
-        st.write("仕事のストレス要因と、周囲のサポートの状況から、高いストレス状態にある可能性が考えられます。")
-
-    if not is_high_stress:
+        for reason in HIGH_STRESS_REASONS[reasons_mask]:
+            st.write(reason)
+    else:
         st.success("現在のところ、総合的なストレスレベルは標準の範囲内と考えられます。")
     st.info("この結果は、あくまで入力に基づく簡易的な評価です。気になる点があれば、専門家（医師、カウンセラーなど）にご相談ください。")
 
 def display_charts(scale_scores):
     """3つのカテゴリについてグラフを表示します。"""
-    for title, definition in CHART_DEFINITIONS.items():
+    chart_specs = get_chart_specs()
+    for title, get_scores in CHART_GETTERS.items():
         st.subheader(title)
-        df = pd.DataFrame(
-            [(s, scale_scores.get(s, 0)) for s in definition["scales"]],
-            columns=['尺度', '点数']
-        )
-        chart = alt.Chart(df).mark_bar().encode(
-            x=alt.X('点数', title='合計点'),
-            y=alt.Y('尺度', title='', sort=None),
-            color=alt.Color('尺度', legend=None, scale=alt.Scale(range=definition["colors"]))
-        ).properties(height=definition["height"])
-        st.altair_chart(chart, use_container_width=True)
-
-def apply_styling():
-    """ページ全体に適用するカスタムCSSを定義します。"""
-    st.markdown("""<style>
+        values = [{"尺度": name, "点数": score}
+                  for name, score in zip(CHART_ROW_KEYS[title], get_scores(scale_scores))]
+        spec = dict(chart_specs[title], data={"values": values})
+        st.vega_lite_chart(spec, use_container_width=True)
+
+@st.cache_resource
+def get_page_css():
+    """ページ全体に適用するカスタムCSSを返します。内容は不変なのでキャッシュする。"""
+    return """<style>
     .question-text { font-size: 1.1rem; font-weight: bold; margin-bottom: 10px; }
     div.row-widget.stRadio > div { flex-direction: row; justify-content: space-around; padding-top: 0px; }
     div.row-widget.stRadio > div > label { display: inline-block; padding: 8px 20px; border: 1px solid #ccc; border-radius: 25px; margin: 0 5px; transition: all 0.2s ease-in-out; cursor: pointer; background-color: #f8f9fa; }
@@ -227,7 +312,11 @@ def apply_styling():
     .heatmap-tile:hover { transform: scale(1.05); }
     .tile-scale-name { font-weight: bold; font-size: 1rem; margin-bottom: 8px; }
     .tile-score { font-size: 2.2rem; font-weight: bold; }
-    </style>""", unsafe_allow_html=True)
+    </style>"""
+
+def apply_styling():
+    """ページ全体にカスタムCSSを適用します。"""
+    st.markdown(get_page_css(), unsafe_allow_html=True)
 
 # --- メイン処理 ---
 
@@ -237,7 +326,12 @@ def main():
 
     # セッション状態の初期化
     if 'current_page' not in st.session_state:
-        st.session_state.current_page = 0
+        # URLクエリのページ番号から復元する（不正値は先頭ページに丸める）
+        try:
+            page = int(st.query_params.get("page", 0))
+        except ValueError:
+            page = 0
+        st.session_state.current_page = min(max(page, 0), NUM_PAGES - 1)
     if 'answers' not in st.session_state:
         st.session_state.answers = {}
     if 'show_results' not in st.session_state:
@@ -249,14 +343,8 @@ def main():
     st.sidebar.info("注意：このツールはあくまでプロトタイプであり、医学的診断に代わるものではありません。")
 
     if not st.session_state.show_results:
-        st.sidebar.markdown("---")
-        st.sidebar.subheader("進捗")
-        total_questions = len(questions_data)
-        answered_count = len(st.session_state.answers)
-        progress = answered_count / total_questions if total_questions > 0 else 0
-        
-        st.sidebar.progress(progress)
-        st.sidebar.write(f"進捗: {answered_count} / {total_questions} 問")
+        with st.sidebar:
+            render_sidebar_progress()
 
     # --- メインコンテンツ ---
     if st.session_state.show_results:
@@ -268,8 +356,7 @@ def main():
             st.error("質問データを読み込めませんでした。questions.csvファイルを確認してください。")
             return
         
-        render_questionnaire()
-        handle_navigation()
+        questionnaire_section()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,23 @@
 # -*- coding: utf-8 -*-
 
-import pandas as pd
+import csv
 
+import streamlit as st
+
+@st.cache_data
 def load_questions_from_csv(file_path="questions.csv"):
-    """CSVファイルから質問データを読み込み、辞書のリスト形式で返す。"""
+    """CSVファイルから質問データを読み込み、辞書のリスト形式で返す。
+
+    Streamlitの再実行のたびにCSVを読み直さないよう、結果をキャッシュする。
+    """
     try:
-        df = pd.read_csv(file_path)
-        # 'reverse'列が文字列として読み込まれる可能性があるので、boolに変換
-        df['reverse'] = df['reverse'].apply(lambda x: str(x).strip().lower() == 'true')
-        return df.to_dict('records')
+        with open(file_path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        # 'reverse'列は文字列として読み込まれるので、その場でboolに変換する
+        # （行ごとに辞書を複製しない）
+        for row in rows:
+            row['reverse'] = row['reverse'].strip().lower() == 'true'
+        return rows
     except FileNotFoundError:
         # Fallback for safety, though the file should exist.
         return []
@@ -36,4 +45,13 @@ scales = {
     "家族・友人のサポート": ["C3", "C6", "C9"],
     "仕事満足度": ["D1"],
     "家庭満足度": ["D2"],
-}
\ No newline at end of file
+}
+
+# スコア計算用に一度だけ構築する補助データ
+# - QUESTION_IDS: 質問IDを出現順に並べたリスト
+# - REVERSE_SET: 逆転項目の質問IDの集合
+# - ID_TO_SCALE: 質問IDから所属する評価尺度名への逆引き
+QUESTION_IDS = [q["id"] for q in questions_data]
+REVERSE_SET = frozenset(q["id"] for q in questions_data if q["reverse"])
+ID_TO_SCALE = {qid: scale_name for scale_name, question_ids in scales.items()
+               for qid in question_ids}
\ No newline at end of file